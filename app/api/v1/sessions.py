@@ -1,17 +1,28 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
 from uuid import uuid4
+import orjson
 from pydantic import BaseModel, Field
-from sqlalchemy.orm import Session
-from typing import List, Optional, Dict, Any
+from typing import Annotated, List, Optional, Dict, Any, Iterator
+from typing_extensions import NotRequired, TypedDict
 from datetime import datetime
 from fastapi import Query
 from enum import Enum
 
-from ...core.database import get_db
-from ...services.database_service import DatabaseService
+from ...services.database_service import DatabaseService, get_db_service
 
 router = APIRouter(prefix="/api", tags=["sessions"])
 
+# Target size of the chunks streamed by the history endpoint
+HISTORY_CHUNK_SIZE = 64 * 1024
+
+class PydanticResponse(JSONResponse):
+    """Response that renders a Pydantic model with its own JSON serializer, bypassing jsonable_encoder."""
+
+    def render(self, content: Any) -> bytes:
+        return content.model_dump_json(by_alias=True).encode()
+
 # Request Models
 class SessionRequest(BaseModel):
     """Request model for creating a new session."""
@@ -72,17 +83,19 @@ class Session(BaseModel):
             }
         }
 
-class ImageSource(BaseModel):
+# Content blocks are only exposed through Message, so they are TypedDicts rather than nested models
+class ImageSource(TypedDict):
     """Model for image source information."""
-    type: str = Field(..., description="Type of image source", example="base64")
-    media_type: str = Field(..., description="MIME type of the image", example="image/png")
-    data: str = Field(..., description="Base64 encoded image data")
+    type: Annotated[str, Field(description="Type of image source", examples=["url"])]
+    media_type: Annotated[str, Field(description="MIME type of the image", examples=["image/png"])]
+    url: NotRequired[Annotated[str, Field(description="URL the stored image is served from", examples=["/static/images/<sha256>.png"])]]
+    data: NotRequired[Annotated[str, Field(description="Base64 encoded image data (legacy rows)")]]
 
-class MessageContent(BaseModel):
+class MessageContent(TypedDict):
     """Model for message content."""
-    type: str = Field(..., description="Type of content", example="text")
-    text: Optional[str] = Field(None, description="Text content")
-    source: Optional[ImageSource] = Field(None, description="Image source information")
+    type: Annotated[str, Field(description="Type of content", examples=["text"])]
+    text: NotRequired[Annotated[Optional[str], Field(description="Text content")]]
+    source: NotRequired[Annotated[Optional[ImageSource], Field(description="Image source information")]]
 
 class Message(BaseModel):
     """Model for a single message in conversation history."""
@@ -124,7 +137,7 @@ class ErrorResponse(BaseModel):
 @router.post("/session", response_model=SessionResponse, status_code=status.HTTP_201_CREATED)
 async def create_session(
     request: SessionRequest, 
-    db: Session = Depends(get_db)
+    db_service: DatabaseService = Depends(get_db_service)
 ):
     """
     Create a new conversation session with the AI agent.
@@ -138,12 +151,12 @@ async def create_session(
     
     Returns a session ID that can be used to connect to the WebSocket endpoint.
     """
-    db_service = DatabaseService(db)
     session_id = str(uuid4())
     display_name = request.display_name or generateSessionName(request.initial_prompt)
     
-    # Create session in database
-    db_service.create_session(
+    # Create session in database (off the event loop)
+    await run_in_threadpool(
+        db_service.create_session,
         session_code=session_id,
         display_name=display_name,
         initial_prompt=request.initial_prompt
@@ -155,15 +168,17 @@ def generateSessionName(prompt_text):
     """Generate a session name from the initial prompt."""
     if not prompt_text:
         return "New Session"
-    lines = prompt_text.split('\n')
-    first_line = lines[0].strip()
+    # Only the first line matters; bound the work regardless of prompt size
+    head = prompt_text[:128]
+    nl = head.find('\n')
+    first_line = (head if nl == -1 else head[:nl]).strip()
     name = first_line[:20] + '...' if len(first_line) > 20 else first_line
     return name or "New Session"
 
 @router.get("/session/{session_id}", response_model=Session)
 async def get_session(
     session_id: str, 
-    db: Session = Depends(get_db)
+    db_service: DatabaseService = Depends(get_db_service)
 ):
     """
     Get the current status and information of a session.
@@ -175,10 +190,10 @@ async def get_session(
     
     Returns session details or a 404 error if the session is not found.
     """
-    db_service = DatabaseService(db)
-    session_data = db_service.get_session_for_api(session_id)
+    session_data = await run_in_threadpool(db_service.get_session_for_api, session_id)
     if session_data:
-        return Session(**session_data)
+        # Trusted DB data: build without validation and serialize straight to JSON
+        return PydanticResponse(content=Session.model_construct(**session_data))
     raise HTTPException(
         status_code=status.HTTP_404_NOT_FOUND,
         detail=f"Session {session_id} not found"
@@ -199,21 +214,21 @@ class SessionSearchResponse(BaseModel):
 async def search_sessions(
     q: Optional[str] = Query(None, min_length=1, description="Text to search for in messages"),
     limit: int = Query(10, ge=1, le=100, description="Max results to return"),
-    db: Session = Depends(get_db)
+    db_service: DatabaseService = Depends(get_db_service)
 ):
     """
     Search for sessions by message content substring (case-insensitive).
 
     Returns the most recent matching message per session. Optionally filter by message type.
     """
-    db_service = DatabaseService(db)
-    items = db_service.search_sessions_by_message_text(q, max_results=limit)
-    return SessionSearchResponse(results=[SessionSearchItem(**item) for item in items])
+    items = await run_in_threadpool(db_service.search_sessions_by_message_text, q, max_results=limit)
+    # Items are already shaped by the service; skip building and re-validating models
+    return ORJSONResponse(content={"results": items})
 
 @router.get("/session/{session_id}/history", response_model=SessionHistory)
 async def get_session_history(
     session_id: str, 
-    db: Session = Depends(get_db)
+    db_service: DatabaseService = Depends(get_db_service)
 ):
     """
     Get the complete conversation history for a session.
@@ -225,17 +240,44 @@ async def get_session_history(
     
     Returns the complete conversation history or a 404 error if the session is not found.
     """
-    db_service = DatabaseService(db)
-    session_data = db_service.get_session_history_for_api(session_id)
-    if session_data:
-        return SessionHistory(**session_data)
+    session = await run_in_threadpool(db_service.get_session, session_id)
+    if session:
+        # Stream messages as they are fetched instead of buffering the whole history
+        return StreamingResponse(
+            _stream_session_history(db_service, session),
+            media_type="application/json"
+        )
     raise HTTPException(
         status_code=status.HTTP_404_NOT_FOUND,
         detail=f"Session {session_id} not found"
     )
 
+def _stream_session_history(db_service: DatabaseService, session) -> Iterator[bytes]:
+    """Assemble the SessionHistory JSON document one message at a time."""
+    header = orjson.dumps({
+        "session_id": session.session_code,
+        "display_name": session.display_name or "New Session",
+        "status": session.status,
+        "created_at": session.created_at,
+        "initial_prompt": session.initial_prompt,
+    })
+    # Reopen the header object to append the messages array
+    buffer = bytearray(header[:-1] + b',"messages":[')
+    first = True
+    for message in db_service.iter_session_messages_json(session.id):
+        if not first:
+            buffer += b","
+        buffer += message
+        first = False
+        # Each yielded chunk costs a threadpool hop and an ASGI send, so flush in ~64KB pieces
+        if len(buffer) >= HISTORY_CHUNK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += b"]}"
+    yield bytes(buffer)
+
 @router.get("/sessions", response_model=SessionList)
-async def list_sessions(db: Session = Depends(get_db)):
+async def list_sessions(db_service: DatabaseService = Depends(get_db_service)):
     """
     Get a list of all available sessions.
     
@@ -245,14 +287,13 @@ async def list_sessions(db: Session = Depends(get_db)):
     This endpoint is useful for displaying a session list in the UI or
     for administrative purposes.
     """
-    db_service = DatabaseService(db)
-    sessions = db_service.get_session_list_for_api()
-    return SessionList(sessions=sessions)
+    sessions = await run_in_threadpool(db_service.get_session_list_for_api)
+    return ORJSONResponse(content={"sessions": sessions})
 
 @router.delete("/session/{session_id}", response_model=DeleteResponse)
 async def delete_session(
     session_id: str, 
-    db: Session = Depends(get_db)
+    db_service: DatabaseService = Depends(get_db_service)
 ):
     """
     Delete a session and all its associated messages.
@@ -264,8 +305,7 @@ async def delete_session(
     
     Returns a success message or a 404 error if the session is not found.
     """
-    db_service = DatabaseService(db)
-    if db_service.delete_session(session_id):
+    if await run_in_threadpool(db_service.delete_session, session_id):
         return DeleteResponse(message=f"Session {session_id} deleted successfully.")
     raise HTTPException(
         status_code=status.HTTP_404_NOT_FOUND,
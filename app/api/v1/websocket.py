@@ -1,18 +1,19 @@
+import logging
 import os
 from typing import Dict, Any, Optional
 from pydantic import BaseModel, Field
 
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
+from fastapi.concurrency import run_in_threadpool
 import asyncio
-from ...core.database import get_db
-from ...models import Session
-from ...services.database_service import DatabaseService
+from ...services.database_service import DatabaseService, get_db_service
 from app.tools.agentic_loop import sampling_loop, APIProvider
 from anthropic.types.beta import BetaTextBlockParam, BetaMessageParam
 
 from ...tools.websocket_agent_handler import WebSocketAgentHandler
 
 router = APIRouter(tags=["websocket"])
+logger = logging.getLogger(__name__)
 
 # WebSocket Message Models for Documentation
 class WebSocketMessage(BaseModel):
@@ -32,7 +33,7 @@ class AgentMessage(BaseModel):
     message: str = Field(..., description="Agent's response text")
 
 class ImageMessage(BaseModel):
-    """Model for image messages."""
+    """Model for image messages (live screenshots are sent as binary JPEG frames instead)."""
     type: str = Field("image", description="Message type")
     data: str = Field(..., description="Base64 encoded image data")
 
@@ -47,24 +48,20 @@ class ErrorMessage(BaseModel):
     message: str = Field(..., description="Error message")
 
 @router.websocket("/ws/session/{session_id}")
-async def websocket_endpoint(websocket: WebSocket, session_id: str, db: Session = Depends(get_db)):
+async def websocket_endpoint(websocket: WebSocket, session_id: str, db_service: DatabaseService = Depends(get_db_service)):
     """WebSocket endpoint for handling AI agent interactions."""
     try:
-        print(f"[WebSocket] Accepting connection for session: {session_id}")
+        logger.debug("Accepting connection for session: %s", session_id)
         await websocket.accept()
-        print(f"[WebSocket] Connection accepted for session: {session_id}")
+        logger.debug("Connection accepted for session: %s", session_id)
 
-        # Create db_service instance
-        db_service = DatabaseService(db)
-
-        # Verify session exists
-        session = db_service.get_session(session_id)
-        if not session:
-            print(f"[WebSocket] Session not found: {session_id}")
+        # Verify session exists (EXISTS query, no ORM row materialized)
+        if not await run_in_threadpool(db_service.session_exists, session_id):
+            logger.info("Session not found: %s", session_id)
             await websocket.close(code=4004, reason="Session not found")
             return
 
-        print(f"[WebSocket] Session found: {session_id}, status: {session.status}")
+        logger.debug("Session found: %s", session_id)
 
         # Instantiate and run the handler
         handler = WebSocketAgentHandler(
@@ -79,9 +76,9 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str, db: Session
         await handler.handle()
 
     except WebSocketDisconnect:
-        print(f"[WebSocket] Client disconnected: {session_id}")
+        logger.debug("Client disconnected: %s", session_id)
     except Exception as e:
-        print(f"[WebSocket] Error in websocket_endpoint: {e}")
+        logger.exception("Error in websocket_endpoint: %s", e)
         try:
             await websocket.close(code=1011, reason=f"Server error: {str(e)}")
         except:
@@ -1,4 +1,5 @@
 import os
+from functools import cached_property
 from typing import Optional
 
 class Settings:
@@ -11,13 +12,27 @@ class Settings:
     
     # API settings
     ANTHROPIC_API_KEY: Optional[str] = os.getenv("ANTHROPIC_API_KEY")
+
+    # Deployment environment; "prod" turns off the interactive API docs and OpenAPI schema
+    ENV: str = os.getenv("ENV", "dev")
+
+    # Logging level for the app's loggers (e.g. DEBUG for websocket lifecycle events)
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
+
+    # Where message images are stored (served under /static/images); keep it on a persistent volume
+    IMAGE_DIR: str = os.getenv("IMAGE_DIR", os.path.join("app", "static", "images"))
     
-    @property
+    # Connection pool per worker process: at most DB_POOL_SIZE + DB_MAX_OVERFLOW connections each
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "20"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "40"))
+
+    # Resolved once per process; the engine and anything else reading it share the same string
+    @cached_property
     def DATABASE_URL(self) -> str:
         # Allow override via DATABASE_URL env (useful for tests/CI)
         override = os.getenv("DATABASE_URL")
         if override:
             return override
-        return f"postgresql://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.POSTGRES_HOST}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
+        return f"postgresql+psycopg2://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.POSTGRES_HOST}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
 
 settings = Settings() 
\ No newline at end of file
@@ -1,10 +1,45 @@
-from sqlalchemy.orm import Session, sessionmaker, declarative_base
-from sqlalchemy import create_engine, text
+import time
+
+import orjson
+from sqlalchemy import create_engine, make_url, text
+from sqlalchemy.orm import Session, declarative_base, sessionmaker
+from sqlalchemy.schema import CreateColumn
+
 from .config import settings
 
+
+def _json_dumps(value) -> str:
+    """orjson-backed serializer for JSON columns (SQLAlchemy expects str, orjson returns bytes)"""
+    return orjson.dumps(value).decode()
+
+def _engine_options(url: str) -> dict:
+    """Pool settings for server databases; SQLite (tests/CI) keeps its default pool"""
+    if make_url(url).get_backend_name() != "postgresql":
+        return {}
+    return {
+        # Long-lived websocket handlers hold connections; size the pool for concurrency. Every
+        # worker has its own pool, so workers * (size + overflow) must fit Postgres max_connections
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_pre_ping": True,
+        # Recycle well before typical proxy/firewall idle timeouts
+        "pool_recycle": 300,
+        # Reuse the most recently returned connection so idle extras age out instead of all staying warm
+        "pool_use_lifo": True,
+    }
+
 # Create engine
-engine = create_engine(settings.DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# JSON columns are encoded/decoded with orjson; on psycopg2 the deserializer is registered as the
+# driver's json/jsonb typecaster, so message content is parsed once, in C
+engine = create_engine(
+    settings.DATABASE_URL,
+    json_serializer=_json_dumps,
+    json_deserializer=orjson.loads,
+    **_engine_options(settings.DATABASE_URL),
+)
+# Keep instances usable after commit: services return rows they just wrote (and cache loaded
+# sessions) without a reload SELECT per attribute access
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 
 # Central SQLAlchemy declarative base used by all models
 Base = declarative_base()
@@ -12,47 +47,131 @@ Base = declarative_base()
 # Import models to register mappings with Base.metadata (after Base is defined)
 from app import models  # noqa: F401,E402
 
-# Create tables after models are imported
-Base.metadata.create_all(bind=engine)
 
-# Lightweight migration to add message_type enum/column if missing (Postgres only)
+# message_type is a stored generated column computed from content (see models.message). Older
+# databases have a plain enum column filled in by the application; replace it (Postgres only)
 def _ensure_message_type_column():
     try:
         with engine.begin() as conn:
-            # Check if column exists
-            col_exists = conn.execute(text(
+            if conn.dialect.name != "postgresql":
+                return
+            is_generated = conn.execute(text(
                 """
-                SELECT 1 FROM information_schema.columns
+                SELECT is_generated FROM information_schema.columns
                 WHERE table_name='messages' AND column_name='message_type'
                 """
-            )).first() is not None
-
-            if not col_exists:
-                # Ensure enum type exists
-                type_exists = conn.execute(text(
-                    "SELECT 1 FROM pg_type WHERE typname = 'message_type'"
-                )).first() is not None
-                if not type_exists:
-                    conn.execute(text("CREATE TYPE message_type AS ENUM ('text','image')"))
-
-                # Add column with default
-                conn.execute(text(
-                    "ALTER TABLE messages ADD COLUMN IF NOT EXISTS message_type message_type NOT NULL DEFAULT 'text'"
-                ))
-
-                # Best-effort backfill: mark as image if any block shows type=image
-                conn.execute(text(
-                    """
-                    UPDATE messages
-                    SET message_type = 'image'
-                    WHERE message_type = 'text' AND content::text LIKE '%"type":"image"%'
-                    """
-                ))
+            )).scalar()
+            if is_generated == "ALWAYS":
+                return
+            # A plain column cannot be turned into a generated one in place: drop and re-add,
+            # which computes the value for every existing row
+            column_ddl = CreateColumn(Base.metadata.tables["messages"].c.message_type).compile(dialect=conn.dialect)
+            conn.execute(text("ALTER TABLE messages DROP COLUMN IF EXISTS message_type"))
+            conn.execute(text(f"ALTER TABLE messages ADD COLUMN {column_ddl}"))
+            conn.execute(text("DROP TYPE IF EXISTS message_type"))
     except Exception:
         # Fail silently; app can still run even if migration didn't apply
         pass
 
-_ensure_message_type_column()
+# Databases created before content became JSONB still have a json column; convert it in place
+def _ensure_content_jsonb():
+    try:
+        with engine.begin() as conn:
+            if conn.dialect.name != "postgresql":
+                return
+            data_type = conn.execute(text(
+                """
+                SELECT data_type FROM information_schema.columns
+                WHERE table_name='messages' AND column_name='content'
+                """
+            )).scalar()
+            if data_type == "json":
+                conn.execute(text("ALTER TABLE messages ALTER COLUMN content TYPE jsonb USING content::jsonb"))
+    except Exception:
+        # Fail silently; the app works with either column type
+        pass
+
+# Searchable text of each message: its text blocks joined by spaces (Postgres only). The column is
+# not mapped on the model so SQLite (tests) keeps working; queries reference it by name
+def _ensure_content_text_column():
+    if engine.dialect.name != "postgresql":
+        return
+    # Search queries reference the column unconditionally, so it must not depend on the extension;
+    # each step runs in its own transaction and only the index needs pg_trgm
+    try:
+        with engine.begin() as conn:
+            # Generated columns may only call immutable functions, hence the wrapper
+            conn.execute(text(
+                """
+                CREATE OR REPLACE FUNCTION message_content_text(content jsonb) RETURNS text
+                LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+                    SELECT string_agg(block #>> '{}', ' ')
+                    FROM jsonb_path_query(content, 'strict $.** ? (@.type == "text" && exists(@.text)).text', '{}', true) AS block
+                $$
+                """
+            ))
+            conn.execute(text(
+                """
+                ALTER TABLE messages ADD COLUMN IF NOT EXISTS content_text text
+                GENERATED ALWAYS AS (message_content_text(content)) STORED
+                """
+            ))
+    except Exception:
+        # Fail silently; search needs the column, the rest of the app does not
+        return
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text(
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_content_text_trgm "
+                "ON messages USING gin (content_text gin_trgm_ops)"
+            ))
+    except Exception:
+        # Fail silently; without the index search falls back to a sequential scan
+        pass
+
+# create_all skips tables that already exist, so indexes added later are created here
+def _ensure_indexes():
+    try:
+        with engine.begin() as conn:
+            for table in Base.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(conn, checkfirst=True)
+    except Exception:
+        # Fail silently; indexes are an optimization only
+        pass
+
+# Arbitrary application-wide key for the migration advisory lock
+_MIGRATION_LOCK_KEY = 0xC0DECAFE
+_MIGRATION_LOCK_POLL_INTERVAL = 0.5
+
+def run_migrations():
+    """Apply the lightweight schema migrations; called once at application startup.
+
+    On PostgreSQL a session-level advisory lock serializes them across workers: the others
+    wait until the schema is ready, then repeat the (idempotent, cheap) checks.
+    """
+    with engine.connect() as conn:
+        is_postgres = conn.dialect.name == "postgresql"
+        if is_postgres:
+            # Poll rather than block in pg_advisory_lock: a waiting statement holds a snapshot,
+            # and the CREATE INDEX CONCURRENTLY run by the lock holder would wait on it (deadlock)
+            while not conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": _MIGRATION_LOCK_KEY}).scalar():
+                conn.commit()
+                time.sleep(_MIGRATION_LOCK_POLL_INTERVAL)
+            conn.commit()
+        try:
+            # Tables are created here rather than at import, so importing the app needs no database
+            Base.metadata.create_all(bind=engine)
+            _ensure_content_jsonb()
+            _ensure_content_text_column()
+            _ensure_message_type_column()
+            _ensure_indexes()
+        finally:
+            if is_postgres:
+                conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _MIGRATION_LOCK_KEY})
+                conn.commit()
 
 def get_db() -> Session:
     """Dependency to get database session"""
@@ -60,4 +179,4 @@ def get_db() -> Session:
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
@@ -1,10 +1,21 @@
+import logging
+import os
+import queue
+from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
+
+import anyio.to_thread
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from starlette.responses import FileResponse
  
 
 from .api.v1 import sessions_router, websocket_router
+from .core.config import settings
+from .core.database import run_migrations
 
 tags_metadata = [
     {
@@ -17,6 +28,39 @@ tags_metadata = [
     },
 ]
 
+def _start_logging() -> QueueListener:
+    """Route app logs through a queue so formatting and stream writes happen off the event loop."""
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+    listener = QueueListener(log_queue, stream_handler)
+
+    app_logger = logging.getLogger("app")
+    app_logger.setLevel(settings.LOG_LEVEL)
+    app_logger.addHandler(QueueHandler(log_queue))
+    app_logger.propagate = False
+    listener.start()
+    return listener
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log_listener = _start_logging()
+    # Sync DB work (endpoints, websocket checks, streamed history) runs in anyio's threadpool;
+    # raise its default of 40 so slow queries do not starve concurrent connections
+    anyio.to_thread.current_default_thread_limiter().total_tokens = 80
+    # Schema migrations run once per process at startup, not at import time
+    await run_in_threadpool(run_migrations)
+    # The /static/images mount needs its directory to exist before the first image is written
+    os.makedirs(settings.IMAGE_DIR, exist_ok=True)
+    # Build the OpenAPI schema before serving traffic; FastAPI caches it on the app afterwards
+    if app.openapi_url:
+        app.openapi()
+    yield
+    log_listener.stop()
+
+# Docs and schema are not served in production, so the schema is never built there
+_docs_enabled = settings.ENV != "prod"
+
 app = FastAPI(
     title="Claude WebSocket Chat",
     description=(
@@ -36,12 +80,18 @@ app = FastAPI(
         "name": "MIT",
         "url": "https://opensource.org/licenses/MIT",
     },
-    docs_url="/api/docs",
-    redoc_url="/api/redoc",
-    openapi_url="/api/openapi.json",
+    docs_url="/api/docs" if _docs_enabled else None,
+    redoc_url="/api/redoc" if _docs_enabled else None,
+    openapi_url="/api/openapi.json" if _docs_enabled else None,
+    # orjson for route responses that return plain data; HTTPException and validation error
+    # bodies still come from Starlette's default JSONResponse handlers
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
 )
 
-# Mount static files
+# Mount static files; stored message images may live outside app/static (IMAGE_DIR), so they get
+# their own mount, registered first so it takes precedence. The directory is created at startup
+app.mount("/static/images", StaticFiles(directory=settings.IMAGE_DIR, check_dir=False), name="images")
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
 @app.get("/", tags=["root"])
@@ -1,5 +1,8 @@
-from sqlalchemy import Column, String, DateTime, Integer, ForeignKey, JSON, Enum as SAEnum
+from sqlalchemy import Column, Computed, String, DateTime, Integer, ForeignKey, Index, JSON, Enum as SAEnum
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import relationship
+from sqlalchemy.sql.expression import ColumnElement
 from datetime import datetime
 from app.core.database import Base
 from enum import Enum
@@ -10,12 +13,43 @@ class MessageType(Enum):
     IMAGE = "image"
 
 
+class _MessageTypeExpression(ColumnElement):
+    """Generation expression for messages.message_type: 'image' if any block has type=image, else 'text'"""
+    type = String()
+    inherit_cache = True
+
+
+@compiles(_MessageTypeExpression, "postgresql")
+def _compile_message_type_postgresql(element, compiler, **kw):
+    return """CASE WHEN jsonb_path_exists(content, '$.**.type ? (@ == "image")') THEN 'image' ELSE 'text' END"""
+
+
+@compiles(_MessageTypeExpression)
+def _compile_message_type_default(element, compiler, **kw):
+    # SQLite (tests) has no JSON path predicates usable in generated columns; match the compact
+    # serialized form written by the engine's orjson serializer
+    return """CASE WHEN content LIKE '%"type":"image"%' THEN 'image' ELSE 'text' END"""
+
+
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # Per-session scans ordered by time; also serves plain session_id lookups
+        Index("ix_messages_session_created", "session_id", "created_at"),
+        # History and message lists are read per session in id order; avoids a sort on large sessions
+        Index("ix_messages_session_id_id", "session_id", "id"),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True)
     session_id = Column(Integer, ForeignKey("sessions.id"), nullable=False)
     role = Column(String(50), nullable=False)
-    content = Column(JSON, nullable=False)
-    message_type = Column(SAEnum(MessageType, name="message_type"), nullable=False, default=MessageType.TEXT)
+    # Binary jsonb on Postgres (GIN-indexable, no reparsing); plain JSON elsewhere, e.g. SQLite in tests
+    content = Column(JSON().with_variant(JSONB, "postgresql"), nullable=False)
+    # Computed by the database from content on insert; never written by the application
+    message_type = Column(
+        SAEnum(MessageType, native_enum=False, create_constraint=False, length=10,
+               values_callable=lambda enum: [member.value for member in enum]),
+        Computed(_MessageTypeExpression(), persisted=True),
+        nullable=False,
+    )
     created_at = Column(DateTime, default=datetime.utcnow)
     session = relationship("Session", back_populates="messages") 
\ No newline at end of file
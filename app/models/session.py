@@ -10,6 +10,6 @@ class Session(Base):
     session_code = Column(String(255), unique=True, index=True, nullable=False)
     display_name = Column(String(255), nullable=True)
     status = Column(String(50), default="running")
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
     initial_prompt = Column(Text, nullable=True)
-    messages = relationship("Message", back_populates="session", cascade="all, delete-orphan") 
\ No newline at end of file
+    messages = relationship("Message", back_populates="session", cascade="all, delete-orphan", order_by="Message.id") 
\ No newline at end of file
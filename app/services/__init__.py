@@ -1,3 +1,4 @@
-from .database_service import DatabaseService
+from .database_service import DatabaseService, get_db_service
+from .message_writer import MessageWriter
 
-__all__ = ["DatabaseService"]
+__all__ = ["DatabaseService", "MessageWriter", "get_db_service"]
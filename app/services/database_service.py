@@ -1,17 +1,46 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import desc, cast, String
+from fastapi import Depends
+from sqlalchemy.orm import Session, raiseload
+from sqlalchemy import delete, desc, cast, exists, lambda_stmt, literal_column, select, update, String, Text
 from sqlalchemy import func
-from sqlalchemy.dialects.postgresql import JSONB
+from cachetools import TTLCache
 from datetime import datetime
-from typing import List, Optional, Dict, Any
-import re
+from typing import List, Optional, Dict, Any, Iterator, Tuple
+import orjson
+import threading
 
+from ..core.database import get_db
 from ..models import Session as SessionModel, Message as MessageModel
 from ..models.message import MessageType
+from .image_store import externalize_images
+
+# Process-wide session_code -> internal id cache. Only the immutable id is cached (not the ORM
+# instance), so entries stay valid across DB sessions; they are dropped when a session is deleted.
+# Deletes made by another worker are not seen until the entry expires, so admission checks
+# (session_exists) always ask the database.
+_session_id_cache: TTLCache = TTLCache(maxsize=10_000, ttl=30)
+_session_id_cache_lock = threading.Lock()
+
+# Short-lived cache of the API views of sessions, keyed by () for the list and (session_code,)
+# for one session. It is per process and cleared by every write, so the TTL only bounds how
+# long writes made by other workers can go unseen.
+_api_cache: TTLCache = TTLCache(maxsize=1024, ttl=2)
+_api_cache_lock = threading.Lock()
+
+# Maximum length of the text snippet returned with each search result
+SNIPPET_LENGTH = 200
+
+
+def _clear_api_cache() -> None:
+    with _api_cache_lock:
+        _api_cache.clear()
+
 
 class DatabaseService:
     def __init__(self, db: Session):
         self.db = db
+        # Sessions loaded through this service; it lives as long as its DB session (one request
+        # or one websocket connection), so repeated lookups of the same code skip the SELECT
+        self._session_cache: Dict[str, SessionModel] = {}
     
     # Session operations
     def create_session(self, session_code: str, display_name: str = None, initial_prompt: str = None) -> SessionModel:
@@ -24,159 +53,261 @@ class DatabaseService:
             initial_prompt=initial_prompt
         )
         self.db.add(session)
+        # Attributes stay loaded after commit (expire_on_commit=False), so no refresh SELECT is needed
         self.db.commit()
-        self.db.refresh(session)
+        self._session_cache[session_code] = session
+        _clear_api_cache()
         return session
     
     def get_session(self, session_code: str) -> Optional[SessionModel]:
         """Get a session by ID"""
-        return self.db.query(SessionModel).filter(SessionModel.session_code == session_code).first()
+        session = self._session_cache.get(session_code)
+        if session is None:
+            # Hot-path lookups use lambda_stmt: the statement is built and cache-keyed once per
+            # code location, with session_code bound as a parameter on each call. Callers (the history
+            # stream among them) read messages with dedicated queries; touching the relationship
+            # raises instead of silently lazy-loading every message
+            session = self.db.scalars(lambda_stmt(
+                lambda: select(SessionModel)
+                .options(raiseload("*"))
+                .where(SessionModel.session_code == session_code)
+            )).first()
+            if session is not None:
+                self._session_cache[session_code] = session
+        return session
+    
+    def session_exists(self, session_code: str) -> bool:
+        """Check whether a session exists without loading the row"""
+        # Not answered from _session_id_cache: another worker may have deleted the session
+        found = self.db.scalar(
+            lambda_stmt(lambda: select(exists().where(SessionModel.session_code == session_code)))
+        )
+        if not found:
+            with _session_id_cache_lock:
+                _session_id_cache.pop(session_code, None)
+        return found
+    
+    def _get_session_id(self, session_code: str) -> Optional[int]:
+        """Resolve a session code to its internal id, served from the TTL cache when possible"""
+        session = self._session_cache.get(session_code)
+        if session is not None:
+            return session.id
+        with _session_id_cache_lock:
+            session_id = _session_id_cache.get(session_code)
+        if session_id is None:
+            session_id = self.db.scalar(
+                lambda_stmt(lambda: select(SessionModel.id).where(SessionModel.session_code == session_code))
+            )
+            if session_id is not None:
+                with _session_id_cache_lock:
+                    _session_id_cache[session_code] = session_id
+        return session_id
     
     def get_all_sessions(self) -> List[SessionModel]:
         """Get all sessions ordered by creation date"""
-        return self.db.query(SessionModel).order_by(desc(SessionModel.created_at)).all()
+        return self.db.scalars(lambda_stmt(lambda: select(SessionModel).order_by(desc(SessionModel.created_at)))).all()
     
     def delete_session(self, session_code: str) -> bool:
         """Delete a session and all its messages"""
-        session = self.get_session(session_code)
-        if session:
-            self.db.delete(session)
-            self.db.commit()
-            return True
-        return False
+        session_id = self._get_session_id(session_code)
+        self._session_cache.pop(session_code, None)
+        with _session_id_cache_lock:
+            _session_id_cache.pop(session_code, None)
+        if session_id is None:
+            return False
+        # Set-based DELETEs: the ORM cascade would load every message (content included) first.
+        # Image files are content-addressed and may be shared with other sessions, so they stay on disk
+        self.db.execute(delete(MessageModel).where(MessageModel.session_id == session_id))
+        deleted = self.db.execute(delete(SessionModel).where(SessionModel.id == session_id)).rowcount
+        self.db.commit()
+        _clear_api_cache()
+        return deleted > 0
     
     def update_session_status(self, session_code: str, status: str) -> bool:
         """Update session status"""
-        session = self.get_session(session_code)
-        if session:
-            session.status = status
-            self.db.commit()
-            return True
-        return False
+        updated = self.db.execute(
+            update(SessionModel).where(SessionModel.session_code == session_code).values(status=status)
+        ).rowcount
+        self.db.commit()
+        # The UPDATE bypassed the ORM, so a cached instance would still carry the old status
+        self._session_cache.pop(session_code, None)
+        _clear_api_cache()
+        return updated > 0
     
     # Message operations
     def add_message(self, session_code: str, role: str, content: List[Dict[str, Any]]) -> MessageModel:
         """Add a message to a session"""
-        # Ensure content is always a list
-        if isinstance(content, str):
-            content = [{"type": "text", "text": content}]
-        elif not isinstance(content, list):
-            content = [{"type": "text", "text": str(content)}]
-        
-        # Resolve internal numeric id
-        session = self.get_session(session_code)
-        if not session:
+        return self.add_messages_bulk(session_code, [(role, content)])[0]
+    
+    def add_messages_bulk(self, session_code: str, messages: List[Tuple[str, List[Dict[str, Any]]]]) -> List[MessageModel]:
+        """Add several (role, content) messages to a session in a single transaction"""
+        # Resolve internal numeric id once for the whole batch
+        session_id = self._get_session_id(session_code)
+        if session_id is None:
             raise ValueError(f"Session not found: {session_code}")
 
-        # Determine message type: if any image blocks, classify as IMAGE; else TEXT
-        message_type: MessageType = MessageType.TEXT
-        try:
-            for block in content:
-                if isinstance(block, dict) and block.get("type") == "image":
-                    message_type = MessageType.IMAGE
-                    break
-        except Exception:
-            message_type = MessageType.TEXT
-        message = MessageModel(
-            session_id=session.id,
-            role=role,
-            content=content,
-            message_type=message_type,
-            created_at=datetime.utcnow()
-        )
-        self.db.add(message)
+        models = []
+        for role, content in messages:
+            # Image bytes go to the image store; the row only keeps a URL reference
+            content = externalize_images(self._normalize_content(content))
+            models.append(MessageModel(
+                session_id=session_id,
+                role=role,
+                content=content,
+                created_at=datetime.utcnow()
+            ))
+        self.db.add_all(models)
         self.db.commit()
-        self.db.refresh(message)
-        return message
+        # Message counts are part of the cached API views
+        _clear_api_cache()
+        return models
+    
+    @staticmethod
+    def _normalize_content(content: Any) -> List[Dict[str, Any]]:
+        """Ensure content is always a list of blocks"""
+        if isinstance(content, str):
+            return [{"type": "text", "text": content}]
+        if not isinstance(content, list):
+            return [{"type": "text", "text": str(content)}]
+        return content
     
     def get_session_messages(self, session_code: str) -> List[MessageModel]:
         """Get all messages for a session ordered by creation time"""
-        session = self.get_session(session_code)
-        if not session:
-            return []
-        return (
-            self.db.query(MessageModel)
-            .filter(MessageModel.session_id == session.id)
+        # Join on the session code instead of loading the session row first
+        return self.db.scalars(lambda_stmt(
+            lambda: select(MessageModel)
+            .join(SessionModel, MessageModel.session_id == SessionModel.id)
+            .where(SessionModel.session_code == session_code)
             .order_by(MessageModel.id.asc())
-            .all()
-        )
+        )).all()
     
     def get_message_count(self, session_code: str) -> int:
         """Get the number of messages in a session"""
-        session = self.get_session(session_code)
-        if not session:
-            return 0
-        return self.db.query(MessageModel).filter(
-            MessageModel.session_id == session.id
-        ).count()
+        # One COUNT over the join; an unknown session simply counts zero rows
+        return self.db.scalar(lambda_stmt(
+            lambda: select(func.count(MessageModel.id))
+            .join(SessionModel, MessageModel.session_id == SessionModel.id)
+            .where(SessionModel.session_code == session_code)
+        ))
     
     # Utility methods for API responses
     def get_session_for_api(self, session_code: str) -> Optional[Dict[str, Any]]:
         """Get session data formatted for API response"""
-        session = self.get_session(session_code)
-        if not session:
+        key = (session_code,)
+        with _api_cache_lock:
+            cached = _api_cache.get(key)
+        if cached is not None:
+            return cached
+
+        # Fetch the row and its message count in one query
+        message_count = (
+            select(func.count(MessageModel.id))
+            .where(MessageModel.session_id == SessionModel.id)
+            .scalar_subquery()
+        )
+        row = (
+            self.db.query(SessionModel, message_count)
+            .options(raiseload("*"))
+            .filter(SessionModel.session_code == session_code)
+            .first()
+        )
+        if not row:
             return None
         
-        return {
+        session, count = row
+        session_data = {
             "session_id": session.session_code,
             "display_name": session.display_name or "New Session",
             "status": session.status,
             "created_at": session.created_at,
             "initial_prompt": session.initial_prompt,
-            "message_count": self.get_message_count(session_code)
+            "message_count": count
         }
+        with _api_cache_lock:
+            _api_cache[key] = session_data
+        return session_data
     
     def get_session_list_for_api(self) -> List[Dict[str, Any]]:
         """Get all sessions formatted for API response"""
-        sessions = self.get_all_sessions()
-        return [
+        with _api_cache_lock:
+            cached = _api_cache.get(())
+        if cached is not None:
+            return cached
+
+        # Single round-trip: aggregate message counts instead of one COUNT per session
+        rows = (
+            self.db.query(
+                SessionModel.session_code,
+                SessionModel.display_name,
+                SessionModel.status,
+                SessionModel.created_at,
+                func.count(MessageModel.id),
+            )
+            .outerjoin(MessageModel, MessageModel.session_id == SessionModel.id)
+            .group_by(SessionModel.id)
+            .order_by(desc(SessionModel.created_at))
+            .all()
+        )
+        sessions = [
             {
-                "session_id": session.session_code,
-                "display_name": session.display_name or "New Session",
-                "status": session.status,
-                "message_count": self.get_message_count(session.session_code),
-                "created_at": session.created_at
+                "session_id": session_code,
+                "display_name": display_name or "New Session",
+                "status": status,
+                "message_count": message_count,
+                "created_at": created_at
             }
-            for session in sessions
+            for session_code, display_name, status, created_at, message_count in rows
         ]
+        with _api_cache_lock:
+            _api_cache[()] = sessions
+        return sessions
     
-    def get_session_history_for_api(self, session_code: str) -> Optional[Dict[str, Any]]:
-        """Get session history formatted for API response"""
-        session = self.get_session(session_code)
-        if not session:
-            return None
-        
-        messages = self.get_session_messages(session_code)
-        message_list = []
-        
-        for msg in messages:
-            # Handle case where content might be a string instead of a list
-            content = msg.content
-            if isinstance(content, str):
-                # Convert string content to proper format
-                content = [{"type": "text", "text": content}]
-            elif not isinstance(content, list):
-                # Fallback for any other unexpected type
-                content = [{"type": "text", "text": str(content)}]
-            
-            message_list.append({
-                "id": msg.id,
-                "role": msg.role,
+    def iter_session_messages_json(self, session_id: int) -> Iterator[bytes]:
+        """Yield a session's messages as JSON-encoded API objects, fetched in batches"""
+        if self._dialect_name() == "postgresql":
+            # Let Postgres build each message object; rows come back as JSON text, no ORM hydration
+            message_json = cast(func.json_build_object(
+                "id", MessageModel.id,
+                "role", MessageModel.role,
+                "content", MessageModel.content,
+                "created_at", MessageModel.created_at,
+            ), Text)
+            rows = (
+                self.db.query(message_json)
+                .filter(MessageModel.session_id == session_id)
+                .order_by(MessageModel.id.asc())
+                .yield_per(100)
+            )
+            for (message,) in rows:
+                yield message.encode()
+            return
+
+        rows = (
+            self.db.query(MessageModel.id, MessageModel.role, MessageModel.content, MessageModel.created_at)
+            .filter(MessageModel.session_id == session_id)
+            .order_by(MessageModel.id.asc())
+            .yield_per(100)
+        )
+        for message_id, role, content, created_at in rows:
+            yield orjson.dumps({
+                "id": message_id,
+                "role": role,
                 "content": content,
-                "created_at": msg.created_at
+                "created_at": created_at
             })
-        
-        return {
-            "session_id": session_code,
-            "display_name": session.display_name or "New Session",
-            "status": session.status,
-            "created_at": session.created_at,
-            "initial_prompt": session.initial_prompt,
-            "messages": message_list
-        } 
+
+    def _dialect_name(self) -> Optional[str]:
+        """Name of the database dialect behind this session, if it can be determined"""
+        try:
+            bind = self.db.get_bind()
+            if bind is not None and hasattr(bind, "dialect"):
+                return bind.dialect.name
+        except Exception:
+            pass
+        return None
 
     def search_sessions_by_message_text(self, query_text: Optional[str], max_results: int = 10) -> List[Dict[str, Any]]:
-        """Search sessions by TEXT messages using JSONB path query (case-insensitive substring).
+        """Search sessions by TEXT messages (case-insensitive substring).
 
         Only TEXT messages are considered; images are excluded.
         Returns at most one most-recent matching message per session.
@@ -184,65 +315,75 @@ class DatabaseService:
         if not query_text:
             return []
 
-        q = (
-            self.db.query(SessionModel, MessageModel)
-            .join(MessageModel, MessageModel.session_id == SessionModel.id)
-            .filter(MessageModel.message_type == MessageType.TEXT)
-        )
+        # Treat the query as literal text: escape LIKE wildcards
+        pattern = "%" + query_text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
 
         # Choose implementation depending on DB dialect
-        dialect_name = None
-        try:
-            bind = self.db.get_bind()
-            if bind is not None and hasattr(bind, "dialect"):
-                dialect_name = bind.dialect.name
-        except Exception:
-            dialect_name = None
-
-        if dialect_name == "postgresql":
-            # PostgreSQL: use JSONB path exists with case-insensitive regex
-            safe = re.escape(query_text)
-            pattern = f".*{safe}.*"
-            jsonpath = f'$.** ? (@.type == "text" && @.text like_regex "{pattern}" flag "i")'
-            q = q.filter(func.jsonb_path_exists(cast(MessageModel.content, JSONB), jsonpath))
+        is_postgres = self._dialect_name() == "postgresql"
+        if is_postgres:
+            # PostgreSQL: ILIKE on the extracted text column, served by its pg_trgm GIN index (see run_migrations);
+            # the snippet is cut from the same column so message content never leaves the database
+            content_text = literal_column("messages.content_text")
+            matches = content_text.ilike(pattern, escape="\\")
+            snippet = func.substr(content_text, 1, SNIPPET_LENGTH)
         else:
             # Fallback for SQLite/others: simple case-insensitive match on serialized content
-            safe = query_text
-            q = q.filter(cast(MessageModel.content, String).ilike(f"%{safe}%"))
-
-        rows = q.order_by(desc(MessageModel.created_at)).limit(max_results).all()
-
-        results: List[Dict[str, Any]] = []
-        seen_session_codes = set()
-        for session, message in rows:
-            if session.session_code in seen_session_codes:
-                continue
-            seen_session_codes.add(session.session_code)
-            content = message.content
-            try:
-                if isinstance(content, list):
-                    text_parts = []
-                    for block in content:
-                        if isinstance(block, dict) and block.get("type") == "text":
-                            text_value = block.get("text")
-                            if isinstance(text_value, str) and text_value:
-                                text_parts.append(text_value)
-                    snippet_text = " ".join(text_parts) if text_parts else None
-                else:
-                    snippet_text = str(content) if content is not None else None
-            except Exception:
-                snippet_text = None
-
-            if snippet_text:
-                snippet_text = snippet_text[:200]
-
-            results.append({
-                "session_id": session.session_code,
-                "display_name": session.display_name,
-                "created_at": session.created_at,
-                "message_id": message.id,
-                "message_created_at": message.created_at,
-                "snippet": snippet_text,
-            })
+            matches = cast(MessageModel.content, String).ilike(pattern, escape="\\")
+            snippet = MessageModel.content
+
+        # Rank matches per session so the newest one per session is picked in SQL; LIMIT then
+        # counts sessions, not messages
+        ranked = (
+            select(
+                MessageModel.id.label("message_id"),
+                func.row_number().over(
+                    partition_by=MessageModel.session_id,
+                    order_by=(desc(MessageModel.created_at), desc(MessageModel.id)),
+                ).label("match_rank"),
+            )
+            .where(MessageModel.message_type == MessageType.TEXT, matches)
+            .subquery()
+        )
+        rows = self.db.execute(
+            select(
+                SessionModel.session_code,
+                SessionModel.display_name,
+                SessionModel.created_at,
+                MessageModel.id,
+                MessageModel.created_at,
+                snippet,
+            )
+            .join(MessageModel, MessageModel.session_id == SessionModel.id)
+            .join(ranked, ranked.c.message_id == MessageModel.id)
+            .where(ranked.c.match_rank == 1)
+            .order_by(desc(MessageModel.created_at))
+            .limit(max_results)
+        ).all()
+
+        return [
+            {
+                "session_id": session_code,
+                "display_name": display_name or "New Session",
+                "created_at": created_at,
+                "message_id": message_id,
+                "message_created_at": message_created_at,
+                "snippet": (snippet_value if is_postgres else self._text_snippet(snippet_value)) or None,
+            }
+            for session_code, display_name, created_at, message_id, message_created_at, snippet_value in rows
+        ]
+
+    @staticmethod
+    def _text_snippet(content: Any) -> Optional[str]:
+        """Join a message's text blocks and cut to SNIPPET_LENGTH (non-Postgres search path)"""
+        if not isinstance(content, list):
+            return str(content)[:SNIPPET_LENGTH] if content is not None else None
+        text_parts = [
+            block["text"] for block in content
+            if isinstance(block, dict) and block.get("type") == "text" and isinstance(block.get("text"), str)
+        ]
+        return " ".join(text_parts)[:SNIPPET_LENGTH]
+
 
-        return results
\ No newline at end of file
+def get_db_service(db: Session = Depends(get_db)) -> DatabaseService:
+    """Dependency to get a DatabaseService bound to the request's database session"""
+    return DatabaseService(db)
@@ -0,0 +1,66 @@
+import binascii
+import hashlib
+import os
+import threading
+from typing import Any, Dict, List
+
+import pybase64
+
+from ..core.config import settings
+
+# Images are content-addressed files, served under IMAGE_URL_PREFIX (see app.main)
+IMAGE_DIR = settings.IMAGE_DIR
+IMAGE_URL_PREFIX = "/static/images"
+
+_EXTENSIONS = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+}
+
+
+def store_image(data: bytes, media_type: str) -> str:
+    """Write image bytes under their sha256 digest and return the URL they are served from"""
+    name = hashlib.sha256(data).hexdigest() + _EXTENSIONS.get(media_type, ".png")
+    path = os.path.join(IMAGE_DIR, name)
+    if not os.path.exists(path):
+        os.makedirs(IMAGE_DIR, exist_ok=True)
+        # Write to a temp file first so readers never see a partial image
+        tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return f"{IMAGE_URL_PREFIX}/{name}"
+
+
+def externalize_images(content: List[Any]) -> List[Any]:
+    """Return a copy of content with base64 image blocks replaced by URL references.
+
+    Image blocks nested in tool_result content are handled too; blocks whose data
+    cannot be decoded are kept as they are.
+    """
+    result = []
+    for block in content:
+        if isinstance(block, dict):
+            if block.get("type") == "image":
+                block = _externalize_image_block(block)
+            elif isinstance(block.get("content"), list):
+                block = {**block, "content": externalize_images(block["content"])}
+        result.append(block)
+    return result
+
+
+def _externalize_image_block(block: Dict[str, Any]) -> Dict[str, Any]:
+    source = block.get("source")
+    if not isinstance(source, dict) or source.get("type") != "base64":
+        return block
+    try:
+        data = pybase64.b64decode(source.get("data") or "", validate=True)
+    except (binascii.Error, ValueError):
+        return block
+    media_type = source.get("media_type") or "image/png"
+    return {
+        **block,
+        "source": {"type": "url", "media_type": media_type, "url": store_image(data, media_type)},
+    }
@@ -0,0 +1,71 @@
+import copy
+import logging
+import queue
+import threading
+from typing import Any, Dict, List, Tuple
+
+from .database_service import DatabaseService
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriter:
+    """Persist session messages from a background thread.
+
+    Writes are queued and drained in batches of up to MAX_BATCH messages, each
+    batch being a single add_messages_bulk call, so commits never block the
+    event loop. The writer owns the database session while it is running.
+
+    At most MAX_PENDING messages wait in the queue; beyond that put() blocks until
+    the database catches up, so messages are never dropped. Call it from a worker
+    thread (asyncio.to_thread) when on the event loop.
+    """
+
+    MAX_BATCH = 50
+    MAX_PENDING = 1000
+    _STOP = object()
+
+    def __init__(self, db_service: DatabaseService, session_code: str):
+        self.db_service = db_service
+        self.session_code = session_code
+        self._queue: queue.Queue = queue.Queue(maxsize=self.MAX_PENDING)
+        self._thread = threading.Thread(target=self._run, name=f"message-writer-{session_code}", daemon=True)
+        self._thread.start()
+
+    def put(self, role: str, content: List[Dict[str, Any]]) -> None:
+        """Queue a single message for persistence, waiting while the queue is full"""
+        # Snapshot the blocks: the sampling loop mutates message content in place
+        # (e.g. prompt-caching markers) while the write may still be pending
+        self._queue.put((role, copy.deepcopy(content)))
+
+    def put_many(self, messages: List[Tuple[str, List[Dict[str, Any]]]]) -> None:
+        """Queue several (role, content) messages, preserving their order"""
+        for role, content in messages:
+            self.put(role, content)
+
+    def close(self) -> None:
+        """Flush pending writes and stop the writer thread (blocking)"""
+        self._queue.put(self._STOP)
+        self._thread.join()
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is self._STOP:
+                return
+            batch = [item]
+            while len(batch) < self.MAX_BATCH:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                self.db_service.add_messages_bulk(self.session_code, batch)
+            except Exception as e:
+                logger.exception("Failed to persist %d message(s): %s", len(batch), e)
+                self.db_service.db.rollback()
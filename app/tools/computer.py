@@ -1,19 +1,15 @@
 import asyncio
-import base64
 import os
 import shlex
-import shutil
 from enum import StrEnum
-from pathlib import Path
 from typing import Literal, TypedDict, cast, get_args
-from uuid import uuid4
 
+import pybase64
 from anthropic.types.beta import BetaToolComputerUse20241022Param, BetaToolUnionParam
 
 from .base import BaseAnthropicTool, ToolError, ToolResult
 from .run import run
-
-OUTPUT_DIR = "/tmp/outputs"
+from .screenshot import capture_png_async
 
 TYPING_DELAY_MS = 12
 TYPING_GROUP_SIZE = 50
@@ -221,31 +217,16 @@ class BaseComputerTool:
 
     async def screenshot(self):
         """Take a screenshot of the current screen and return the base64 encoded image."""
-        output_dir = Path(OUTPUT_DIR)
-        output_dir.mkdir(parents=True, exist_ok=True)
-        path = output_dir / f"screenshot_{uuid4().hex}.png"
-
-        # Try gnome-screenshot first
-        if shutil.which("gnome-screenshot"):
-            screenshot_cmd = f"{self._display_prefix}gnome-screenshot -f {path} -p"
-        else:
-            # Fall back to scrot if gnome-screenshot isn't available
-            screenshot_cmd = f"{self._display_prefix}scrot -p {path}"
-
-        result = await self.shell(screenshot_cmd, take_screenshot=False)
+        # Captured and encoded in-process (on a worker thread): no screenshot/convert subprocesses or temp files
+        display = f":{self.display_num}" if self.display_num is not None else None
+        size = None
         if self._scaling_enabled:
-            x, y = self.scale_coordinates(
-                ScalingSource.COMPUTER, self.width, self.height
-            )
-            await self.shell(
-                f"convert {path} -resize {x}x{y}! {path}", take_screenshot=False
-            )
-
-        if path.exists():
-            return result.replace(
-                base64_image=base64.b64encode(path.read_bytes()).decode()
-            )
-        raise ToolError(f"Failed to take screenshot: {result.error}")
+            size = self.scale_coordinates(ScalingSource.COMPUTER, self.width, self.height)
+        try:
+            png = await capture_png_async(display, size)
+        except Exception as e:
+            raise ToolError(f"Failed to take screenshot: {e}") from e
+        return ToolResult(base64_image=pybase64.b64encode_as_string(png))
 
     async def shell(self, command: str, take_screenshot=True) -> ToolResult:
         """Run a shell command and return the output, error, and optionally a screenshot."""
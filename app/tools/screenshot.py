@@ -1,9 +1,49 @@
-import subprocess
-import base64
-
-def take_screenshot():
-    """Take screenshot from the VNC (Xvfb) session and return base64-encoded PNG"""
-    cmd = "xwd -display :1 -root | convert xwd:- png:-"
-    result = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE)
-    return base64.b64encode(result.stdout).decode("utf-8")
+import asyncio
+import binascii
+import io
+
+import mss
+import pybase64
+from PIL import Image
+
+# zlib level 1: a few percent larger than the default, several times faster to encode
+PNG_COMPRESS_LEVEL = 1
+# Quality of the JPEG previews streamed to the browser; the model keeps receiving lossless PNG
+PREVIEW_JPEG_QUALITY = 75
+
+
+def capture_png(display: str | None = ":1", size: tuple[int, int] | None = None) -> bytes:
+    """Grab the X display in-process and return it as PNG bytes, optionally resized to (width, height)"""
+    with mss.MSS(display=display) as sct:
+        raw = sct.grab(sct.monitors[1])
+    # mss returns BGRA pixels; let Pillow's raw decoder drop the padding byte and swap channels
+    image = Image.frombytes("RGB", raw.size, raw.bgra, "raw", "BGRX")
+    if size and size != image.size:
+        image = image.resize(size)
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG", compress_level=PNG_COMPRESS_LEVEL)
+    return buffer.getvalue()
+
+
+def encode_preview_jpeg(data_b64: str) -> bytes | None:
+    """Decode a base64 image and re-encode it as JPEG for display.
+
+    Returns None when data_b64 is not valid base64; images Pillow cannot read are returned as decoded.
+    """
+    try:
+        raw = pybase64.b64decode(data_b64, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    try:
+        with Image.open(io.BytesIO(raw)) as image:
+            buffer = io.BytesIO()
+            image.convert("RGB").save(buffer, "JPEG", quality=PREVIEW_JPEG_QUALITY)
+            return buffer.getvalue()
+    except Exception:
+        return raw
+
+
+async def capture_png_async(display: str | None = ":1", size: tuple[int, int] | None = None) -> bytes:
+    """capture_png in a worker thread; grabbing and PNG-encoding a frame would otherwise block the event loop"""
+    return await asyncio.to_thread(capture_png, display, size)
 
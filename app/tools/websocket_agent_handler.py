@@ -1,15 +1,31 @@
 import asyncio
+import hashlib
+import logging
+import orjson
 from fastapi import WebSocket, WebSocketDisconnect
 from typing import List
 from anthropic.types.beta import BetaMessageParam
 
 from .agentic_loop import APIProvider, sampling_loop
 from ..core.config import settings
+from ..services.message_writer import MessageWriter
+from .screenshot import encode_preview_jpeg
+
+logger = logging.getLogger(__name__)
 
 class WebSocketAgentHandler:
 
     MODEL = "claude-sonnet-4-20250514"
     TOOL_VERSION = "computer_use_20250124"
+    # Small frames queued within SEND_BATCH_WINDOW seconds go out as one JSON array frame
+    SEND_BATCH_MAX = 32
+    SEND_BATCH_WINDOW = 0.005
+    # Frames waiting for a slow client beyond this are dropped, oldest first
+    OUTBOX_MAXSIZE = 256
+    # How long a closing handler waits for queued frames (e.g. a final error) to be sent
+    DRAIN_TIMEOUT = 2.0
+    # Queued last when the handler finishes; the writer stops once it reaches it
+    _CLOSE = object()
 
     def __init__(self, websocket: WebSocket, session_id: str, db_service, api_provider: APIProvider, sampling_loop, messages_for_api: List[BetaMessageParam]):
         self.websocket = websocket
@@ -19,81 +35,160 @@ class WebSocketAgentHandler:
         self.sampling_loop = sampling_loop
         self.messages_for_api = messages_for_api
         self.connected = True
+        # Outgoing frames go through a single writer task to keep them ordered
+        self._outbox: asyncio.Queue = asyncio.Queue(maxsize=self.OUTBOX_MAXSIZE)
+        self._carry = None
+        self._writer_task = None
+        # Digest of the last image sent, so repeated identical frames (an idle screen) are skipped
+        self._last_image_hash = None
+        # DB writes are handed to a background thread so commits do not block the loop
+        self._message_writer = None
 
-    async def send_message(self, message: dict):
+    def _enqueue(self, message: dict):
         if not self.connected:
             return
+        self._put(message)
+
+    def _put(self, message):
+        if self._outbox.full():
+            # Callbacks are sync and must not block the sampling loop; keep the newest output instead
+            self._outbox.get_nowait()
+            logger.warning("Outbox full for session %s, dropped oldest frame", self.session_id)
+        self._outbox.put_nowait(message)
+
+    def _enqueue_image(self, data: str):
+        # Hash the base64 text as-is: identical PNGs encode identically, and no decode is needed
+        image_hash = hashlib.blake2b(data.encode("ascii"), digest_size=16).digest()
+        if image_hash == self._last_image_hash:
+            return
+        self._last_image_hash = image_hash
+        self._enqueue({
+            "type": "image",
+            "data": data
+        })
+
+    async def send_message(self, message: dict):
+        self._enqueue(message)
+
+    async def _next_batch(self) -> List[dict]:
+        """Collect queued frames up to SEND_BATCH_MAX; images are always sent on their own"""
+        message = self._carry or await self._outbox.get()
+        self._carry = None
+        batch = [message]
+        if self._sent_alone(message):
+            return batch
+        if self._outbox.empty():
+            await asyncio.sleep(self.SEND_BATCH_WINDOW)
+        while len(batch) < self.SEND_BATCH_MAX and not self._outbox.empty():
+            message = self._outbox.get_nowait()
+            if self._sent_alone(message):
+                self._carry = message
+                break
+            batch.append(message)
+        return batch
+
+    def _sent_alone(self, message) -> bool:
+        return message is self._CLOSE or message.get("type") == "image"
+
+    async def _writer(self):
+        while True:
+            batch = await self._next_batch()
+            if batch[0] is self._CLOSE:
+                return
+            if not self.connected:
+                continue
+            payload = batch[0] if len(batch) == 1 else batch
+            try:
+                if len(batch) == 1 and payload.get("type") == "image":
+                    # Images go out as binary JPEG frames: no base64 inflation or JSON encoding
+                    preview = await asyncio.to_thread(encode_preview_jpeg, payload["data"])
+                    if preview is None:
+                        # A bad frame is dropped on its own; the connection keeps streaming
+                        logger.warning("Dropped undecodable image frame for session %s", self.session_id)
+                        continue
+                    await self.websocket.send_bytes(preview)
+                else:
+                    # orjson instead of send_json's stdlib json; text frames keep JSON.parse working client-side
+                    await self.websocket.send_text(orjson.dumps(payload).decode())
+            except Exception as e:
+                logger.warning("Failed to send: %s", e)
+                self.connected = False
+
+    async def _drain_outbox(self):
+        """Send the frames still queued (e.g. a final error message), then stop the writer"""
+        self._put(self._CLOSE)
         try:
-            await self.websocket.send_json(message)
-        except Exception as e:
-            print(f"[WebSocket Error] Failed to send: {e}")
-            self.connected = False
+            await asyncio.wait_for(self._writer_task, timeout=self.DRAIN_TIMEOUT)
+        except TimeoutError:
+            # wait_for has cancelled the writer; whatever is left is dropped
+            logger.warning("Timed out sending queued frames for session %s", self.session_id)
+        self.connected = False
 
     def output_callback(self, block):
         if block["type"] == "thinking":
             thinking_text = block.get("text", "") or block.get("thinking", "")
             if thinking_text:
-                asyncio.create_task(self.send_message({
+                self._enqueue({
                     "type": "thinking",
                     "message": thinking_text
-                }))
+                })
         elif block["type"] == "text":
             # Only stream to client; persistence happens after sampling completes
-            asyncio.create_task(self.send_message({
+            self._enqueue({
                 "type": "agent_message",
                 "message": block["text"]
-            }))
+            })
         elif block["type"] == "image":
             if block.get("source") and block["source"].get("type") == "base64":
-                asyncio.create_task(self.send_message({
-                    "type": "image",
-                    "data": block["source"]["data"]
-                }))
+                self._enqueue_image(block["source"]["data"])
         elif block["type"] == "tool_use":
-            print(f"[*] Tool requested: {block.get('name', '')} (id={block.get('id', '')})")
+            logger.debug("Tool requested: %s (id=%s)", block.get("name", ""), block.get("id", ""))
         else:
-            asyncio.create_task(self.send_message({
+            self._enqueue({
                 "type": "output",
                 "content": block
-            }))
+            })
 
     def tool_output_callback(self, tool_result, tool_use_id):
+        # Common case for silent tools: nothing to forward
+        if not (tool_result.output or tool_result.base64_image or tool_result.error):
+            return
         if tool_result.output:
-            asyncio.create_task(self.send_message({
+            self._enqueue({
                 "type": "agent_message",
                 "message": tool_result.output
-            }))
+            })
         if tool_result.base64_image:
-            asyncio.create_task(self.send_message({
-                "type": "image",
-                "data": tool_result.base64_image
-            }))
+            self._enqueue_image(tool_result.base64_image)
         if tool_result.error:
-            asyncio.create_task(self.send_message({
+            self._enqueue({
                 "type": "agent_message",
                 "message": f"Error: {tool_result.error}"
-            }))
+            })
 
     def api_response_callback(self, req, res, err):
         if err:
-            print(f"[API Error] {err}")
-            asyncio.create_task(self.send_message({
+            logger.error("API error: %s", err)
+            self._enqueue({
                 "type": "agent_message",
                 "message": f"API Error: {err}"
-            }))
+            })
 
     async def handle(self):
+        self._writer_task = asyncio.create_task(self._writer())
+        self._message_writer = MessageWriter(self.db_service, self.session_id)
         try:
             while self.connected:
                 try:
-                    # First try to receive as JSON
-                    data = await self.websocket.receive_json()
-                    user_message = data.get("message", "")
+                    # Decode inbound frames with orjson; only {"message": str} is expected
+                    data = orjson.loads(await self.websocket.receive_text())
+                    user_message = data.get("message", "") if isinstance(data, dict) else ""
                     if not user_message:
                         continue
 
-                    print(f"[*] Received message: {user_message}")
-                    self.db_service.add_message(self.session_id, "user", [{"type": "text", "text": user_message}])
+                    logger.debug("Received message: %s", user_message)
+                    # put() may wait for the writer when its queue is full; keep that off the loop
+                    await asyncio.to_thread(self._message_writer.put, "user", [{"type": "text", "text": user_message}])
                     self.messages_for_api.append({
                         "role": "user",
                         "content": [{"type": "text", "text": user_message}]
@@ -125,47 +220,44 @@ class WebSocketAgentHandler:
                             token_efficient_tools_beta=False
                         )
                     except Exception as e:
-                        print(f"[Error] Sampling loop failed: {e}")
+                        logger.exception("Sampling loop failed: %s", e)
                         await self.send_message({
                             "type": "agent_message",
                             "message": f"Error: {str(e)}"
                         })
 
                     if len(self.messages_for_api) > original_count:
+                        # Collect everything the sampling loop appended and persist it in one transaction
+                        new_messages = []
                         for i in range(original_count, len(self.messages_for_api)):
                             msg = self.messages_for_api[i]
                             role = msg.get("role")
                             content = msg.get("content", [])
                             if role == "assistant":
-                                try:
-                                    self.db_service.add_message(self.session_id, "assistant", content)
-                                except Exception as e:
-                                    print(f"[DB] Failed to persist assistant message: {e}")
+                                new_messages.append(("assistant", content))
                             elif role == "user":
                                 # Handle tool results or extra user blocks that sampling_loop may have appended
                                 if content and isinstance(content, list):
                                     if len(content) == 1 and content[0].get("type") == "tool_result":
                                         tool_result_content = content[0].get("content", [])
                                         if tool_result_content:
-                                            self.db_service.add_message(self.session_id, "user", tool_result_content)
+                                            new_messages.append(("user", tool_result_content))
                                     else:
-                                        self.db_service.add_message(self.session_id, "user", content)
+                                        new_messages.append(("user", content))
+                        await asyncio.to_thread(self._message_writer.put_many, new_messages)
 
-                except ValueError as e:
-                    try:
-                        text_data = await self.websocket.receive_text()
-                    except:
-                        pass
+                except ValueError:
+                    # Malformed JSON frame: it has already been consumed, skip it
                     continue
                 except WebSocketDisconnect:
-                    print(f"[-] WebSocket disconnected: {self.session_id}")
+                    logger.debug("WebSocket disconnected: %s", self.session_id)
                     self.connected = False
                     break
                 except Exception as e:
-                    print(f"[Error] Error processing message: {e}")
+                    logger.error("Error processing message: %s", e)
                     # Check if this is a connection close error
                     if "Cannot call 'receive'" in str(e) or "NO_STATUS_RCVD" in str(e) or "1005" in str(e):
-                        print(f"[Info] WebSocket connection closed by client: {self.session_id}")
+                        logger.debug("WebSocket connection closed by client: %s", self.session_id)
                         self.connected = False
                         break
                     else:
@@ -173,11 +265,11 @@ class WebSocketAgentHandler:
                         continue
 
         except WebSocketDisconnect:
-            print(f"[-] WebSocket disconnected: {self.session_id}")
+            logger.debug("WebSocket disconnected: %s", self.session_id)
             self.connected = False
         except Exception as e:
-            print(f"[Error] WebSocket error: {e}")
-            self.connected = False
+            logger.exception("WebSocket error: %s", e)
+            # The socket may still be open: the error frame is sent while the outbox drains below
             try:
                 await self.send_message({
                     "type": "agent_message",
@@ -185,3 +277,15 @@ class WebSocketAgentHandler:
                 })
             except:
                 pass
+        finally:
+            try:
+                await self._drain_outbox()
+            finally:
+                # Make sure every queued message is persisted before the DB session is released. Shielded:
+                # if this task is cancelled (shutdown), request teardown must still wait for the last commit
+                closing = asyncio.ensure_future(asyncio.to_thread(self._message_writer.close))
+                try:
+                    await asyncio.shield(closing)
+                except asyncio.CancelledError:
+                    await closing
+                    raise
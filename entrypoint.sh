@@ -8,7 +8,9 @@ python http_server.py > /tmp/server_logs.txt 2>&1 &
 
 
 echo "✨ Starting FastAPI server on port 8081..."
-python -m uvicorn app.main:app --host 0.0.0.0 --port 8081 --reload &
+python -m uvicorn app.main:app --host 0.0.0.0 --port 8081 \
+    --loop uvloop --http httptools --ws websockets \
+    --workers "${WEB_CONCURRENCY:-1}" &
 echo "✨ Computer Use Demo is ready!"
 
 # Keep the container running
@@ -1,26 +1,54 @@
 import pytest
-from sqlalchemy import create_engine
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 
 from app.main import app
 from app.core import database as core_db
 from app.models import Base  # ensures models are imported
+from app.services import image_store
+from app.services.database_service import DatabaseService, _api_cache, _session_id_cache
 
 
-@pytest.fixture(autouse=True, scope="function")
-def _override_db_dependency():
+@pytest.fixture(scope="session")
+def _test_engine():
     # Use an in-memory SQLite database for tests (isolated from real Postgres)
-    # Use StaticPool so the in-memory DB persists across connections within a test
+    # Use StaticPool so the in-memory DB persists across connections; the schema is created once
     engine = create_engine(
         "sqlite+pysqlite:///:memory:",
         connect_args={"check_same_thread": False},
         poolclass=StaticPool,
+        # Same JSON serialization as the app engine; the message_type generated column relies on it
+        json_serializer=core_db._json_dumps,
     )
-    TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-    # Create schema for tests
+    # pysqlite's own transaction handling breaks SAVEPOINT; let SQLAlchemy emit BEGIN itself
+    @event.listens_for(engine, "connect")
+    def _disable_pysqlite_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def _emit_begin(conn):
+        conn.exec_driver_sql("BEGIN")
+
     Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture(autouse=True, scope="function")
+def _override_db_dependency(_test_engine):
+    # Each test runs inside one outer transaction that is rolled back afterwards; commits made
+    # by the app only release SAVEPOINTs within it
+    connection = _test_engine.connect()
+    transaction = connection.begin()
+    TestingSessionLocal = sessionmaker(
+        bind=connection,
+        autoflush=False,
+        expire_on_commit=False,
+        join_transaction_mode="create_savepoint",
+    )
 
     def get_test_db():
         db = TestingSessionLocal()
@@ -34,6 +62,29 @@ def _override_db_dependency():
 
     yield
 
-    # Teardown: remove override
+    # Teardown: remove override, discard everything the test wrote and anything cached
     app.dependency_overrides.pop(core_db.get_db, None)
+    transaction.rollback()
+    connection.close()
+    _session_id_cache.clear()
+    _api_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def _image_dir(tmp_path, monkeypatch):
+    # Keep stored images out of app/static during tests
+    monkeypatch.setattr(image_store, "IMAGE_DIR", str(tmp_path / "images"))
+    return tmp_path / "images"
+
+
+@pytest.fixture()
+def client():
+    return TestClient(app)
+
 
+@pytest.fixture()
+def db_service():
+    # Reuse the test DB dependency so the service sees the same data as the API
+    db_gen = app.dependency_overrides[core_db.get_db]()
+    yield DatabaseService(next(db_gen))
+    db_gen.close()
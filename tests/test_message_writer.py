@@ -0,0 +1,27 @@
+from app.services.message_writer import MessageWriter
+
+
+def test_message_writer_persists_in_order(client, db_service):
+    session_id = client.post("/api/session", json={"display_name": "Writer"}).json()["session_id"]
+    writer = MessageWriter(db_service, session_id)
+    writer.put("user", [{"type": "text", "text": "one"}])
+    writer.put_many([
+        ("assistant", [{"type": "text", "text": "two"}]),
+        ("user", [{"type": "text", "text": "three"}]),
+    ])
+    writer.close()
+
+    messages = client.get(f"/api/session/{session_id}/history").json()["messages"]
+    assert [m["content"][0]["text"] for m in messages] == ["one", "two", "three"]
+
+
+def test_message_writer_snapshots_content(client, db_service):
+    session_id = client.post("/api/session", json={"display_name": "Writer"}).json()["session_id"]
+    content = [{"type": "text", "text": "original"}]
+    writer = MessageWriter(db_service, session_id)
+    writer.put("user", content)
+    content[0]["text"] = "mutated"
+    writer.close()
+
+    messages = client.get(f"/api/session/{session_id}/history").json()["messages"]
+    assert messages[0]["content"][0]["text"] == "original"
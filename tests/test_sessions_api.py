@@ -1,13 +1,9 @@
 import pytest
-from fastapi.testclient import TestClient
+from sqlalchemy.exc import InvalidRequestError
 from unittest.mock import MagicMock
 
-from app.main import app
-
-
-@pytest.fixture()
-def client():
-    return TestClient(app)
+from app.api.v1 import sessions as sessions_api
+from app.services.database_service import DatabaseService, _session_id_cache
 
 
 def test_list_sessions_empty(client):
@@ -30,6 +26,43 @@ def test_get_session_not_found(client):
     assert res.json()["detail"].startswith("Session does-not-exist not found")
 
 
+def test_get_session_found(client):
+    created = client.post("/api/session", json={"display_name": "Demo", "initial_prompt": "hi"})
+    session_id = created.json()["session_id"]
+    res = client.get(f"/api/session/{session_id}")
+    assert res.status_code == 200
+    body = res.json()
+    assert body["session_id"] == session_id
+    assert body["display_name"] == "Demo"
+    assert body["initial_prompt"] == "hi"
+    # Extra service fields are not leaked into the response schema
+    assert "message_count" not in body
+
+
+def test_session_exists(client, db_service):
+    session_id = client.post("/api/session", json={"display_name": "Demo"}).json()["session_id"]
+    assert db_service.session_exists(session_id) is True
+    assert db_service.session_exists("does-not-exist") is False
+
+
+def test_session_id_cache_invalidated_on_delete(client, db_service):
+    session_id = client.post("/api/session", json={"display_name": "Cached"}).json()["session_id"]
+    db_service.add_message(session_id, "user", [{"type": "text", "text": "warm the cache"}])
+    assert db_service.session_exists(session_id) is True
+
+    assert client.delete(f"/api/session/{session_id}").status_code == 200
+    assert db_service.session_exists(session_id) is False
+    with pytest.raises(ValueError):
+        db_service.add_message(session_id, "user", [{"type": "text", "text": "too late"}])
+
+
+def test_session_exists_ignores_stale_cache_entries(client, db_service):
+    # As if another worker deleted the session after this one cached its id
+    _session_id_cache["deleted-elsewhere"] = 12345
+    assert db_service.session_exists("deleted-elsewhere") is False
+    assert "deleted-elsewhere" not in _session_id_cache
+
+
 def test_search_sessions_with_data(client):
     # Create a session via API (initial_prompt stored with session)
     create_res = client.post("/api/session", json={"display_name": "Demo", "initial_prompt": "hello world"})
@@ -43,6 +76,52 @@ def test_search_sessions_with_data(client):
     assert isinstance(data["results"], list)
 
 
+def test_search_sessions_returns_latest_match_per_session(client, db_service):
+    session_id = client.post("/api/session", json={"display_name": "Cats"}).json()["session_id"]
+    db_service.add_messages_bulk(session_id, [
+        ("user", [{"type": "text", "text": "find cat pictures"}]),
+        ("assistant", [{"type": "text", "text": "Here are the Cat pictures"}]),
+    ])
+
+    results = client.get("/api/sessions/search", params={"q": "cat pic"}).json()["results"]
+    assert len(results) == 1
+    assert results[0]["session_id"] == session_id
+    assert results[0]["display_name"] == "Cats"
+    assert results[0]["snippet"] == "Here are the Cat pictures"
+
+
+def test_search_limit_counts_sessions(client, db_service):
+    older = client.post("/api/session", json={"display_name": "Older"}).json()["session_id"]
+    newer = client.post("/api/session", json={"display_name": "Newer"}).json()["session_id"]
+    db_service.add_messages_bulk(older, [("user", "deploy the app")])
+    db_service.add_messages_bulk(newer, [("user", f"deploy attempt {i}") for i in range(3)])
+
+    results = client.get("/api/sessions/search", params={"q": "deploy", "limit": 2}).json()["results"]
+    assert [r["session_id"] for r in results] == [newer, older]
+    assert results[0]["snippet"] == "deploy attempt 2"
+
+
+def test_search_treats_wildcards_literally(client, db_service):
+    session_id = client.post("/api/session", json={"display_name": "Progress"}).json()["session_id"]
+    db_service.add_message(session_id, "assistant", [{"type": "text", "text": "download at 100%"}])
+    db_service.add_message(session_id, "assistant", [{"type": "text", "text": "download at 1000"}])
+
+    results = client.get("/api/sessions/search", params={"q": "100%"}).json()["results"]
+    assert [r["snippet"] for r in results] == ["download at 100%"]
+    assert client.get("/api/sessions/search", params={"q": "at_1"}).json()["results"] == []
+
+
+def test_search_skips_text_blocks_without_text(client, db_service):
+    session_id = client.post("/api/session", json={"display_name": "Malformed"}).json()["session_id"]
+    db_service.add_message(session_id, "assistant", [
+        {"type": "text"},
+        {"type": "text", "text": "still searchable"},
+    ])
+
+    results = client.get("/api/sessions/search", params={"q": "searchable"}).json()["results"]
+    assert [r["snippet"] for r in results] == ["still searchable"]
+
+
 def test_session_list_after_create(client):
     # Create two sessions
     r1 = client.post("/api/session", json={"display_name": "One", "initial_prompt": "hi"})
@@ -62,6 +141,68 @@ def test_session_list_after_create(client):
         assert key in item
 
 
+def test_session_list_message_counts(client, db_service):
+    with_messages = client.post("/api/session", json={"display_name": "Busy"}).json()["session_id"]
+    empty = client.post("/api/session", json={"display_name": "Idle"}).json()["session_id"]
+    db_service.add_message(with_messages, "user", [{"type": "text", "text": "hi"}])
+    db_service.add_message(with_messages, "assistant", [{"type": "text", "text": "hello"}])
+
+    res = client.get("/api/sessions")
+    assert res.status_code == 200
+    counts = {s["session_id"]: s["message_count"] for s in res.json()["sessions"]}
+    assert counts[with_messages] == 2
+    assert counts[empty] == 0
+
+
+def test_session_list_cache_invalidated_by_writes(client, db_service):
+    session_id = client.post("/api/session", json={"display_name": "Cached"}).json()["session_id"]
+    assert db_service.get_session_list_for_api() is db_service.get_session_list_for_api()
+    assert db_service.get_session_for_api(session_id)["message_count"] == 0
+
+    db_service.add_message(session_id, "user", [{"type": "text", "text": "hi"}])
+    assert db_service.get_session_list_for_api()[0]["message_count"] == 1
+    assert db_service.get_session_for_api(session_id)["message_count"] == 1
+
+    db_service.update_session_status(session_id, "completed")
+    assert db_service.get_session_for_api(session_id)["status"] == "completed"
+
+    client.delete(f"/api/session/{session_id}")
+    assert db_service.get_session_list_for_api() == []
+    assert db_service.get_session_for_api(session_id) is None
+
+
+def test_add_messages_bulk(client, db_service):
+    session_id = client.post("/api/session", json={"display_name": "Bulk"}).json()["session_id"]
+    db_service.add_messages_bulk(session_id, [
+        ("assistant", [{"type": "text", "text": "looking"}]),
+        ("user", [{"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": "AAAA"}}]),
+        ("assistant", "done"),
+    ])
+
+    messages = client.get(f"/api/session/{session_id}/history").json()["messages"]
+    assert [m["role"] for m in messages] == ["assistant", "user", "assistant"]
+    assert messages[2]["content"] == [{"type": "text", "text": "done"}]
+    assert [m.message_type.value for m in db_service.get_session_messages(session_id)] == ["text", "image", "text"]
+
+
+def test_images_are_stored_by_url(client, db_service, _image_dir):
+    session_id = client.post("/api/session", json={"display_name": "Images"}).json()["session_id"]
+    image = {"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": "iVBORw0KGgo="}}
+    db_service.add_messages_bulk(session_id, [
+        ("user", [image]),
+        ("user", [{"type": "tool_result", "tool_use_id": "t1", "content": [image]}]),
+    ])
+
+    messages = client.get(f"/api/session/{session_id}/history").json()["messages"]
+    source = messages[0]["content"][0]["source"]
+    assert source["type"] == "url"
+    assert source["url"].startswith("/static/images/") and source["url"].endswith(".png")
+    assert messages[1]["content"][0]["content"][0]["source"] == source
+    # Identical images share one file
+    assert len(list(_image_dir.iterdir())) == 1
+    assert image["source"]["type"] == "base64"
+
+
 def test_delete_session_flow(client):
     # Create a session
     resp = client.post("/api/session", json={"display_name": "ToDelete", "initial_prompt": "x"})
@@ -93,6 +234,18 @@ def test_session_history_initial_empty(client):
     assert len(hist_body.get("messages", [])) == 0
 
 
+def test_session_history_returns_messages_in_order(client, db_service):
+    session_id = client.post("/api/session", json={"display_name": "Chat"}).json()["session_id"]
+    db_service.add_message(session_id, "user", [{"type": "text", "text": "first"}])
+    db_service.add_message(session_id, "assistant", [{"type": "text", "text": "second"}])
+
+    hist = client.get(f"/api/session/{session_id}/history")
+    assert hist.status_code == 200
+    messages = hist.json()["messages"]
+    assert [m["role"] for m in messages] == ["user", "assistant"]
+    assert [m["content"][0]["text"] for m in messages] == ["first", "second"]
+
+
 def test_generate_session_name_on_missing_display(client):
     # No display_name provided, ensure API generates a non-empty display name from initial_prompt
     long_prompt = "This is a very long initial prompt that should be trimmed to a short display name"
@@ -104,3 +257,53 @@ def test_generate_session_name_on_missing_display(client):
     # should be <= 23 chars if truncated to 20 + '...'
     assert len(body["display_name"]) <= 23
 
+
+def test_generate_session_name_uses_first_line(client):
+    res = client.post("/api/session", json={"initial_prompt": "  Open firefox\nthen search for cats"})
+    assert res.status_code == 201
+    assert res.json()["display_name"] == "Open firefox"
+
+
+def test_history_streams_large_sessions(client, db_service, monkeypatch):
+    monkeypatch.setattr(sessions_api, "HISTORY_CHUNK_SIZE", 64)
+    session_id = client.post("/api/session", json={"display_name": "Long"}).json()["session_id"]
+    db_service.add_messages_bulk(session_id, [("user", f"message {i}") for i in range(50)])
+
+    body = client.get(f"/api/session/{session_id}/history").json()
+    assert [m["content"][0]["text"] for m in body["messages"]] == [f"message {i}" for i in range(50)]
+
+
+def test_update_session_status(client, db_service):
+    session_id = client.post("/api/session", json={"display_name": "Status"}).json()["session_id"]
+    assert db_service.update_session_status(session_id, "completed") is True
+    assert client.get(f"/api/session/{session_id}").json()["status"] == "completed"
+    assert db_service.update_session_status("missing", "completed") is False
+
+
+def test_message_count(client, db_service):
+    session_id = client.post("/api/session", json={"display_name": "Count"}).json()["session_id"]
+    db_service.add_messages_bulk(session_id, [("user", "one"), ("assistant", "two")])
+    assert db_service.get_message_count(session_id) == 2
+    assert db_service.get_message_count("missing") == 0
+    assert db_service.get_session_messages("missing") == []
+
+
+def test_get_session_is_cached_per_service(client, db_service):
+    session_id = client.post("/api/session", json={"display_name": "Cached"}).json()["session_id"]
+    session = db_service.get_session(session_id)
+    assert db_service.get_session(session_id) is session
+
+    assert db_service.delete_session(session_id) is True
+    assert db_service.get_session(session_id) is None
+
+
+def test_loaded_sessions_do_not_lazy_load_messages(client, db_service):
+    session_id = client.post("/api/session", json={"display_name": "Strict"}).json()["session_id"]
+    db_service.add_message(session_id, "user", [{"type": "text", "text": "hi"}])
+    db_service.db.expunge_all()
+
+    session = DatabaseService(db_service.db).get_session(session_id)
+    with pytest.raises(InvalidRequestError):
+        _ = session.messages
+    # The history endpoint streams messages with its own query
+    assert len(client.get(f"/api/session/{session_id}/history").json()["messages"]) == 1
@@ -0,0 +1,169 @@
+import asyncio
+import base64
+import io
+import time
+
+import orjson
+import pytest
+from fastapi import WebSocketDisconnect
+from PIL import Image
+
+from app.core.config import settings
+from app.tools.base import ToolResult
+from app.tools.websocket_agent_handler import WebSocketAgentHandler
+
+
+class FakeWebSocket:
+    """Records frames sent by the handler; text frames are decoded back from JSON"""
+
+    def __init__(self, expected_frames: int):
+        self.sent = []
+        self.expected_frames = expected_frames
+        self.done = asyncio.Event()
+
+    def _record(self, frame):
+        self.sent.append(frame)
+        if len(self.sent) >= self.expected_frames:
+            self.done.set()
+
+    async def send_text(self, data):
+        self._record(orjson.loads(data))
+
+    async def send_bytes(self, data):
+        self._record(data)
+
+
+def _png_b64(color="red") -> str:
+    buffer = io.BytesIO()
+    Image.new("RGB", (4, 4), color).save(buffer, "PNG")
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def _message(text: str) -> dict:
+    return {"type": "agent_message", "message": text}
+
+
+def _handler(websocket) -> WebSocketAgentHandler:
+    return WebSocketAgentHandler(websocket, "s", None, None, None, [])
+
+
+async def _run_writer(handler):
+    """Run the writer until the fake websocket has received the expected number of frames"""
+    task = asyncio.create_task(handler._writer())
+    try:
+        await asyncio.wait_for(handler.websocket.done.wait(), timeout=2)
+    finally:
+        task.cancel()
+
+
+async def test_undecodable_image_is_skipped():
+    websocket = FakeWebSocket(expected_frames=1)
+    handler = _handler(websocket)
+    handler._enqueue({"type": "image", "data": "abc"})
+    handler._enqueue({"type": "agent_message", "message": "still here"})
+    await _run_writer(handler)
+
+    assert handler.connected
+    assert websocket.sent == [{"type": "agent_message", "message": "still here"}]
+
+
+async def test_queued_frames_are_coalesced_into_one_array():
+    websocket = FakeWebSocket(expected_frames=1)
+    handler = _handler(websocket)
+    for text in ("one", "two", "three"):
+        handler._enqueue(_message(text))
+    await _run_writer(handler)
+
+    assert websocket.sent == [[_message("one"), _message("two"), _message("three")]]
+
+
+async def test_images_are_sent_alone_and_in_order():
+    websocket = FakeWebSocket(expected_frames=3)
+    handler = _handler(websocket)
+    handler._enqueue(_message("before"))
+    handler._enqueue(_message("also before"))
+    handler._enqueue({"type": "image", "data": _png_b64()})
+    handler._enqueue(_message("after"))
+    await _run_writer(handler)
+
+    batch, image, after = websocket.sent
+    assert batch == [_message("before"), _message("also before")]
+    # Images go out as binary JPEG previews
+    assert isinstance(image, bytes) and image.startswith(b"\xff\xd8")
+    assert after == _message("after")
+
+
+async def test_full_outbox_drops_oldest_frame(monkeypatch):
+    monkeypatch.setattr(WebSocketAgentHandler, "OUTBOX_MAXSIZE", 2)
+    websocket = FakeWebSocket(expected_frames=1)
+    handler = _handler(websocket)
+    for text in ("oldest", "middle", "newest"):
+        handler._enqueue(_message(text))
+    await _run_writer(handler)
+
+    assert websocket.sent == [[_message("middle"), _message("newest")]]
+
+
+async def test_identical_consecutive_images_are_sent_once():
+    websocket = FakeWebSocket(expected_frames=2)
+    handler = _handler(websocket)
+    red, blue = _png_b64("red"), _png_b64("blue")
+    handler.output_callback({"type": "image", "source": {"type": "base64", "data": red}})
+    handler.tool_output_callback(ToolResult(base64_image=red), "tool-1")
+    handler.tool_output_callback(ToolResult(base64_image=blue), "tool-2")
+    await _run_writer(handler)
+
+    assert len(websocket.sent) == 2
+    assert all(isinstance(frame, bytes) for frame in websocket.sent)
+    assert handler._outbox.empty() and handler._carry is None
+
+
+
+
+async def test_closing_handler_sends_frames_still_queued():
+    websocket = FakeWebSocket(expected_frames=2)
+    handler = _handler(websocket)
+    handler._writer_task = asyncio.create_task(handler._writer())
+    handler._enqueue(_message("Error: sampling failed"))
+    handler._enqueue({"type": "image", "data": _png_b64()})
+    await handler._drain_outbox()
+
+    assert websocket.sent[0] == _message("Error: sampling failed")
+    assert isinstance(websocket.sent[1], bytes)
+    assert handler._writer_task.done() and not handler.connected
+
+
+class OneMessageWebSocket(FakeWebSocket):
+    """Delivers one user message, then reports the client as gone"""
+
+    def __init__(self, message: str):
+        super().__init__(expected_frames=1)
+        self.incoming = [orjson.dumps({"message": message}).decode()]
+
+    async def receive_text(self):
+        if self.incoming:
+            return self.incoming.pop(0)
+        raise WebSocketDisconnect()
+
+
+async def test_cancelled_handler_still_persists_queued_messages(db_service, monkeypatch):
+    monkeypatch.setattr(settings, "ANTHROPIC_API_KEY", None)
+    db_service.create_session("cancelled")
+    add_messages_bulk = db_service.add_messages_bulk
+
+    def slow_add_messages_bulk(*args):
+        time.sleep(0.3)
+        return add_messages_bulk(*args)
+
+    monkeypatch.setattr(db_service, "add_messages_bulk", slow_add_messages_bulk)
+    handler = WebSocketAgentHandler(OneMessageWebSocket("keep me"), "cancelled", db_service, None, None, [])
+    task = asyncio.create_task(handler.handle())
+    # Cancel while the handler waits for the (slow) final commit, as a server shutdown would
+    await asyncio.sleep(0.1)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert [m.content for m in db_service.get_session_messages("cancelled")] == [
+        [{"type": "text", "text": "keep me"}]
+    ]